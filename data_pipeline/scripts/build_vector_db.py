@@ -1,11 +1,39 @@
 import chromadb
-from sentence_transformers import SentenceTransformer
+import torch
 import json
 import os
 import glob
+import hashlib
+import numpy as np
+
+from fastapi_app.embedding_model import MODEL_NAME, load_embedding_model as load_base_embedding_model, onnx_model_file
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
 
 # --- Configuration ---
-MODEL_NAME = 'all-MiniLM-L6-v2' # A good starting model
+# Option keys and their labels in the embedded text, formatted once at load time
+OPTION_FIELDS = tuple((f"option{i}", f"Option {i}: ") for i in range(1, 5))
+# Documents per forward pass. encode() sorts its input by length before batching,
+# so each batch only pads up to similarly sized documents.
+ENCODE_BATCH_SIZE = 64
+# Questions embedded and upserted per chunk; bounds memory and each Chroma
+# request payload (keeping it below Chroma's maximum batch size) for large sections
+UPSERT_BATCH_SIZE = 5000
+# Embeddings from previous runs, keyed by a hash of the model setup and document
+# text and stored next to each exam's vector DB, so rebuilds only encode new text
+EMBEDDING_CACHE_FILE = 'embedding_cache.npz'
+# HNSW build parameters, applied when a collection is first created. The larger
+# batch_size/sync_threshold let a bulk upsert land in bigger index batches and
+# persist the index less often than Chroma's defaults (100/1000) during ingest.
+HNSW_METADATA = {
+    "hnsw:construction_ef": 100,
+    "hnsw:M": 16,
+    "hnsw:batch_size": 1000,
+    "hnsw:sync_threshold": UPSERT_BATCH_SIZE
+}
 
 def get_paths(exam_type):
     """Get data and vector DB paths for a specific exam type"""
@@ -14,39 +42,167 @@ def get_paths(exam_type):
     vector_db_path = os.path.join(base_path, 'app_data', 'vector_db', exam_type.upper())
     return data_dir, vector_db_path
 
-def _construct_document_from_question(question_data):
+def load_embedding_model():
+    """
+    Loads the shared embedding model (fp16 on a GPU, int8 ONNX on CPU when
+    available) and, on a single GPU, compiles it for the bulk encode.
+    """
+    model = load_base_embedding_model()
+    if model.device.type == "cuda" and torch.cuda.device_count() == 1:
+        # Fuse the transformer's kernels; dynamic shapes avoid a recompile for every
+        # new batch sequence length, and the warm-up absorbs the one-off compile time.
+        # With several GPUs, each encode worker gets its own (eager) copy instead.
+        model[0].auto_model = torch.compile(model[0].auto_model, dynamic=True)
+        with torch.inference_mode():
+            model.encode(["warmup"] * ENCODE_BATCH_SIZE, batch_size=ENCODE_BATCH_SIZE)
+    return model
+
+def start_encode_pool(model):
+    """
+    Starts one encode worker process per GPU when more than one is available,
+    so each batch of documents is split across all devices. Returns None otherwise.
+    """
+    gpu_count = torch.cuda.device_count()
+    if gpu_count < 2:
+        return None
+    print(f"Starting encode workers on {gpu_count} GPUs...")
+    return model.start_multi_process_pool(target_devices=[f"cuda:{i}" for i in range(gpu_count)])
+
+class Embedder:
+    """
+    Owns the loaded sentence transformer and its multi-GPU encode pool (if any),
+    so a single instance can be shared by the builds for every exam type.
+    """
+    def __init__(self):
+        self.model = load_embedding_model()
+        self.pool = start_encode_pool(self.model)
+        # fp16 CUDA, int8 ONNX and fp32 PyTorch give slightly different vectors,
+        # so cached embeddings are only reused for the same model setup
+        backend = getattr(self.model, 'backend', 'torch')
+        if backend == 'onnx':
+            backend = f"onnx:{onnx_model_file()}"
+        self.cache_prefix = f"{MODEL_NAME}|{backend}|{self.model.device.type}|"
+
+    def _cache_key(self, document):
+        return hashlib.blake2b((self.cache_prefix + document).encode('utf-8'), digest_size=16).hexdigest()
+
+    def cache_keys(self, documents):
+        """Returns the embedding cache key of each document."""
+        return [self._cache_key(document) for document in documents]
+
+    def encode(self, documents, cache=None):
+        """
+        Embeds a batch of documents into a contiguous float32 array. When a cache
+        dict is given, only documents missing from it are run through the model
+        and their embeddings are added to it.
+        """
+        if cache is None:
+            return self._encode(documents)
+
+        keys = self.cache_keys(documents)
+        missing = [i for i, key in enumerate(keys) if key not in cache]
+        if missing:
+            print(f"Embedding {len(missing)} documents not found in the embedding cache...")
+            for i, embedding in zip(missing, self._encode([documents[i] for i in missing])):
+                cache[keys[i]] = embedding
+        return np.stack([cache[key] for key in keys])
+
+    def _encode(self, documents):
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                documents,
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=True,
+                pool=self.pool
+            )
+        # Chroma accepts the array directly; a contiguous float32 block avoids building
+        # a Python list of boxed floats per vector (and undoes fp16 on the GPU path)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def close(self):
+        """Stops the encode worker processes, if any were started."""
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def load_embedding_cache(cache_path):
+    """Loads cached embeddings as a {key: vector} dict (empty if there is no cache yet)."""
+    if not os.path.exists(cache_path):
+        return {}
+    with np.load(cache_path, allow_pickle=False) as data:
+        return dict(zip(data['keys'].tolist(), data['embeddings']))
+
+def save_embedding_cache(cache_path, cache, used_keys):
+    """
+    Writes the embedding cache atomically, so an interrupted run cannot corrupt it.
+    Only entries for documents of the current run (used_keys) are kept, so vectors
+    for edited or removed questions do not accumulate across rebuilds.
+    """
+    cache = {key: embedding for key, embedding in cache.items() if key in used_keys}
+    if not cache:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        return
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, keys=np.array(list(cache)), embeddings=np.stack(list(cache.values())))
+    os.replace(temp_path, cache_path)
+
+def _load_questions(json_file):
+    """Loads a structured questions JSON file, using orjson when it is installed."""
+    if orjson is not None:
+        with open(json_file, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(json_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _construct_documents(questions):
     """
-    Constructs a single string from a question object for embedding,
+    Constructs the embedding string for every question in a batch,
     handling the 'option1', 'option2', etc., format.
     """
-    # Start with the core question text and section
-    text_parts = [
-        f"Section: {question_data.get('section', '')}",
-        f"Question: {question_data.get('question_text', '')}"
-    ]
+    documents = []
+    append = documents.append
+    for question_data in questions:
+        get = question_data.get
+        # Start with the core question text and section
+        text_parts = [
+            f"Section: {get('section', '')}",
+            f"Question: {get('question_text', '')}"
+        ]
 
-    # Append options if they exist
-    for i in range(1, 5):
-        option_key = f"option{i}"
-        if option_key in question_data:
-            text_parts.append(f"Option {i}: {question_data[option_key]}")
+        # Append options if they exist
+        for option_key, option_label in OPTION_FIELDS:
+            if option_key in question_data:
+                text_parts.append(f"{option_label}{question_data[option_key]}")
 
-    return " ".join(text_parts)
+        append(" ".join(text_parts))
+    return documents
 
-def build_vector_database_for_exam(exam_type):
+def build_vector_database_for_exam(exam_type, embedder=None):
     """
     Reads structured JSON data, creates text embeddings, and stores them in
     separate ChromaDB collections for each section of a specific exam type.
+    Pass an existing Embedder to share one loaded model across exam types.
     """
+    if embedder is None:
+        embedder = Embedder()
+        try:
+            return build_vector_database_for_exam(exam_type, embedder)
+        finally:
+            embedder.close()
+
     print(f"\n=== Building Vector Database for {exam_type} ===")
     data_dir, vector_db_path = get_paths(exam_type)
     
-    print(f"Loading sentence transformer model: {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME)
-    
     print(f"Initializing persistent vector database at: {vector_db_path}")
     os.makedirs(vector_db_path, exist_ok=True)
     client = chromadb.PersistentClient(path=vector_db_path)
+    cache_path = os.path.join(vector_db_path, EMBEDDING_CACHE_FILE)
+    embedding_cache = load_embedding_cache(cache_path)
+    # Cache keys of every document in this build, unchanged ones included
+    used_cache_keys = set()
     
     json_files = glob.glob(os.path.join(data_dir, "*.json"))
     
@@ -77,50 +233,83 @@ def build_vector_database_for_exam(exam_type):
         print(f"\n--- Processing: {filename} -> {collection_name} ---")
 
         # Get or create a dedicated collection for the section
-        collection = client.get_or_create_collection(name=collection_name)
+        collection = client.get_or_create_collection(name=collection_name, metadata=HNSW_METADATA)
         
-        with open(json_file, 'r', encoding='utf-8') as f:
-            questions = json.load(f)
+        questions = _load_questions(json_file)
 
         if not questions:
             print(f"No questions found in {filename}. Skipping.")
             continue
 
-        print(f"Preparing {len(questions)} documents for embedding...")
-        documents = [_construct_document_from_question(q) for q in questions]
-        
-        # Create metadata including available fields
-        metadatas = []
-        for q in questions:
-            metadata = {"year": q.get('year', 0), "slot": q.get('slot', 0)}
-            if 'stream' in q:
-                metadata['stream'] = q['stream']
-            metadatas.append(metadata)
-        
-        ids = [q['id'] for q in questions]
+        # Metadata is kept column-wise; per-question dicts are only built for the
+        # chunk being upserted, since that is the form Chroma's API requires
+        question_count = len(questions)
+        years = np.fromiter((q.get('year', 0) for q in questions), dtype=np.int32, count=question_count)
+        slots = np.fromiter((q.get('slot', 0) for q in questions), dtype=np.int32, count=question_count)
+        streams = [q.get('stream') for q in questions]
 
-        print(f"Generating embeddings for {len(documents)} documents... (This may take a moment)")
-        embeddings = model.encode(documents, show_progress_bar=True)
-        
-        print(f"Upserting {len(ids)} documents into the '{collection_name}' collection...")
-        # Use upsert to add new documents or update existing ones based on ID
-        collection.upsert(
-            ids=ids,
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas,
-            documents=documents
-        )
+        print(f"Embedding {question_count} documents in batches of {UPSERT_BATCH_SIZE}... (This may take a moment)")
+        # Build, embed and upsert one chunk at a time so only a single chunk of
+        # documents and embeddings is held in memory, however large the section is
+        for start in range(0, question_count, UPSERT_BATCH_SIZE):
+            end = start + UPSERT_BATCH_SIZE
+            batch = questions[start:end]
+            documents = _construct_documents(batch)
+            used_cache_keys.update(embedder.cache_keys(documents))
+            
+            # Create metadata including available fields
+            metadatas = [
+                {"year": int(year), "slot": int(slot)} if stream is None
+                else {"year": int(year), "slot": int(slot), "stream": stream}
+                for year, slot, stream in zip(years[start:end], slots[start:end], streams[start:end])
+            ]
+            
+            ids = [q['id'] for q in batch]
+
+            # Embedding dominates the build, so skip questions already stored with the
+            # same document and metadata; only new or changed ones are re-embedded
+            existing = collection.get(ids=ids, include=["documents", "metadatas"])
+            stored = {
+                qid: (doc, meta)
+                for qid, doc, meta in zip(existing["ids"], existing["documents"], existing["metadatas"])
+            }
+            changed = [i for i, qid in enumerate(ids) if stored.get(qid) != (documents[i], metadatas[i])]
+            if not changed:
+                print(f"All {len(ids)} documents are already up to date. Skipping.")
+                continue
+            if len(changed) < len(ids):
+                print(f"Skipping {len(ids) - len(changed)} unchanged documents.")
+                documents = [documents[i] for i in changed]
+                metadatas = [metadatas[i] for i in changed]
+                ids = [ids[i] for i in changed]
+
+            embeddings = embedder.encode(documents, embedding_cache)
+            
+            print(f"Upserting {len(ids)} documents into the '{collection_name}' collection...")
+            # Use upsert to add new documents or update existing ones based on ID
+            collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                documents=documents
+            )
         
         count = collection.count()
         print(f"Collection '{collection_name}' now contains {count} items.")
 
+    save_embedding_cache(cache_path, embedding_cache, used_cache_keys)
     print(f"\nVector database build complete for {exam_type}.")
     print(f"Database files are stored in: {os.path.abspath(vector_db_path)}")
 
 def build_all_vector_databases():
     """Build vector databases for both CAT and GATE exams"""
-    for exam_type in ["CAT", "GATE"]:
-        build_vector_database_for_exam(exam_type)
+    # Load the model (and multi-GPU workers) once and reuse them for every exam type
+    embedder = Embedder()
+    try:
+        for exam_type in ["CAT", "GATE"]:
+            build_vector_database_for_exam(exam_type, embedder)
+    finally:
+        embedder.close()
     print("\n=== All vector databases built successfully ===")
 
 
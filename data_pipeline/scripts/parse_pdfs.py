@@ -1,25 +1,78 @@
-import fitz  # PyMuPDF
 import re
 import json
 import os
 import glob
-from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+# --- Configuration ---
+# Extracted PDF text is cached here, keyed by file name, mtime, size and the
+# extractor version, so re-runs skip PyMuPDF for PDFs that have not changed
+TEXT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'source_pdfs', '.text_cache')
+# Bump whenever extract_pdf_text's output changes, so stale cached text is not reused
+TEXT_CACHE_VERSION = 1
+# Upper bound on parser worker processes; extraction scaling flattens out
+# beyond a handful of workers while each one still costs a process start-up
+MAX_PARSE_WORKERS = 6
+
+# --- Compiled Patterns ---
+# Question markers: CAT uses "Q. 1)" and GATE uses "Q.1" (without parentheses)
+_CAT_QHEAD_RE = re.compile(r'Q\.\s?\d+\)')
+_GATE_QHEAD_RE = re.compile(r'Q\.\s?\d+(?=\s|$)')
+_GATE_OPTION_MARK_RE = re.compile(r'\([A-D]\)')
+# CAT options: A. text, [1] text, a) text, 1. text
+_CAT_OPT_RE = re.compile(
+    r'(\n(?:[A-D]\)|[A-D]\.|\[[1-4]\]|[a-d]\))\s)(.*?)(?=\n(?:[A-D]\)|[A-D]\.|\[[1-4]\]|[a-d]\))|\Z)',
+    re.DOTALL
+)
+# GATE options: (A) text, (B) text, (C) text, (D) text
+_GATE_OPT_RE = re.compile(
+    r'(\n?\s*\(([A-D])\)\s*)(.*?)(?=\s*\([A-D]\)|\Z)',
+    re.DOTALL
+)
+# Any run of whitespace (line breaks from the PDF layout included), collapsed to one space
+_WS_RE = re.compile(r'\s+')
+# Filenames like 'CAT-2022-Slot-2...' / 'CAT-2024-Slot-01...' and
+# 'GATE-2023-CS-Session-1...' / 'GATE-2024-EE...'
+_CAT_FILENAME_RE = re.compile(r'CAT-(\d{4}).*slot-0?(\d+)', re.IGNORECASE)
+_GATE_FILENAME_RE = re.compile(r'GATE-(\d{4})-([A-Z]{2,3}).*(?:session|slot)?-?0?(\d+)?', re.IGNORECASE)
+# Section keywords per exam, checked in order (first match wins). Matching
+# case-insensitively avoids lowercasing a copy of every question block.
+_SECTION_PATTERNS = {
+    "CAT": [
+        (re.compile(r'verbal ability|varc', re.IGNORECASE), ("Verbal Ability and Reading Comprehension", "VARC")),
+        (re.compile(r'data interpretation|dilr', re.IGNORECASE), ("Data Interpretation and Logical Reasoning", "DILR")),
+        (re.compile(r'quantitative aptitude|quant', re.IGNORECASE), ("Quantitative Aptitude", "QA")),
+    ],
+    "GATE": [
+        (re.compile(r'general aptitude|ga', re.IGNORECASE), ("General Aptitude", "GA")),
+        (re.compile(r'technical|engineering|mathematics|subject', re.IGNORECASE), ("Technical", "TECH")),
+    ],
+}
+
+# Section files are ordered by year, then slot, then ID; every parsed question has all three
+_SORT_KEY = itemgetter('year', 'slot', 'id')
 
 # --- Helper Functions ---
+@lru_cache(maxsize=2048)
 def parse_metadata_from_filename(filename):
     """
     Extracts exam, year, and slot information from the PDF filename.
     Handles variations in naming conventions for both CAT and GATE.
     """
-    # Regex for CAT filenames like 'CAT-2022-Slot-2...' or 'CAT-2024-Slot-01...'
-    cat_match = re.search(r'CAT-(\d{4}).*slot-0?(\d+)', filename, re.IGNORECASE)
+    cat_match = _CAT_FILENAME_RE.search(filename)
     if cat_match:
         year = int(cat_match.group(1))
         slot = int(cat_match.group(2))
         return "CAT", year, slot
     
-    # Regex for GATE filenames like 'GATE-2023-CS-Session-1...' or 'GATE-2024-EE...'
-    gate_match = re.search(r'GATE-(\d{4})-([A-Z]{2,3}).*(?:session|slot)?-?0?(\d+)?', filename, re.IGNORECASE)
+    gate_match = _GATE_FILENAME_RE.search(filename)
     if gate_match:
         year = int(gate_match.group(1))
         stream = gate_match.group(2).upper()
@@ -32,24 +85,73 @@ def get_section_and_abbreviation(text, exam_type="CAT"):
     """
     Determines the exam section based on keywords in the text for both CAT and GATE.
     """
-    text_lower = text.lower()
-    
-    if exam_type == "CAT":
-        if "verbal ability" in text_lower or "varc" in text_lower:
-            return "Verbal Ability and Reading Comprehension", "VARC"
-        elif "data interpretation" in text_lower or "dilr" in text_lower:
-            return "Data Interpretation and Logical Reasoning", "DILR"
-        elif "quantitative aptitude" in text_lower or "quant" in text_lower:
-            return "Quantitative Aptitude", "QA"
-    elif exam_type == "GATE":
-        if "general aptitude" in text_lower or "ga" in text_lower:
-            return "General Aptitude", "GA"
-        elif any(term in text_lower for term in ["technical", "engineering", "mathematics", "subject"]):
-            return "Technical", "TECH"
+    for pattern, section in _SECTION_PATTERNS.get(exam_type, ()):
+        if pattern.search(text):
+            return section
             
     return "Unknown", "Unknown"
 
 
+def write_questions_json(output_filepath, questions):
+    """
+    Writes questions as indented UTF-8 JSON, using orjson when it is installed.
+    The document is serialized up front and written in a single call.
+    """
+    if orjson is not None:
+        data = orjson.dumps(questions, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(questions, indent=2, ensure_ascii=False).encode('utf-8')
+    with open(output_filepath, 'wb') as f:
+        f.write(data)
+
+
+def extract_pdf_text(pdf_filepath):
+    """
+    Returns the text of all non-empty pages of a PDF, reusing the cached text
+    when the file is unchanged. Raises if the PDF cannot be read.
+    """
+    stat = os.stat(pdf_filepath)
+    cache_name = f"{os.path.basename(pdf_filepath)}_{stat.st_mtime_ns}_{stat.st_size}_v{TEXT_CACHE_VERSION}.txt"
+    cache_path = os.path.join(TEXT_CACHE_DIR, cache_name)
+    try:
+        with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    import fitz  # PyMuPDF; only needed when the text is not cached
+
+    # Collect the page texts and join them once, rather than growing one string page by page
+    page_texts = []
+    with fitz.open(pdf_filepath) as doc:
+        # get_page_text loads and drops each page in turn, so no Page objects are kept alive
+        for page_number in range(doc.page_count):
+            page_text = doc.get_page_text(page_number, "text")
+            if page_text.strip():  # Only add non-empty pages
+                page_texts.append(page_text)
+    # Workers parse many PDFs in turn; drop MuPDF's cached fonts and resources
+    # between documents instead of letting the store grow to its limit
+    fitz.TOOLS.store_shrink(100)
+    pdf_text = "\n".join(page_texts) + "\n" if page_texts else ""
+
+    # Write atomically; PDFs are parsed in parallel worker processes. The cache is
+    # best-effort: if it cannot be written (read-only or full disk), the text is
+    # still returned
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(pdf_text)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: Could not cache extracted text for {pdf_filepath}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return pdf_text
+
+
 def convert_questions_to_json(pdf_filepath):
     """
     Extracts text from a PDF and converts questions into a list of JSON objects.
@@ -69,82 +171,53 @@ def convert_questions_to_json(pdf_filepath):
         exam, year, slot = metadata
         stream = None
     
-    pdf_text = ""
     try:
-        with fitz.open(pdf_filepath) as doc:
-            for page in doc:
-                page_text = page.get_text()
-                if page_text.strip():  # Only add non-empty pages
-                    pdf_text += page_text + "\n"
+        pdf_text = extract_pdf_text(pdf_filepath)
     except Exception as e:
         print(f"Error reading PDF file {pdf_filepath}: {e}")
         return []
 
-    # Split the text by common question markers
+    # Locate the common question markers in a single scan; each question block
+    # runs from its marker up to the next one (or the end of the text)
     # For CAT: Q. 1), Q. 2) format
     # For GATE: Q.1, Q.2 format (without parentheses)
+    # Bind the exam-specific patterns once, outside the per-question loop
     if exam == "CAT":
-        question_blocks = re.split(r'(?=Q\.\s?\d+\))', pdf_text)
-    else:  # GATE format
-        question_blocks = re.split(r'(?=Q\.\s?\d+(?:\s|$))', pdf_text)
+        question_head_pattern, option_pattern = _CAT_QHEAD_RE, _CAT_OPT_RE
+        option_text_group = 2  # CAT: group 1 is the marker, group 2 the text
+    else:  # GATE
+        question_head_pattern, option_pattern = _GATE_QHEAD_RE, _GATE_OPT_RE
+        option_text_group = 3  # GATE: group 2 is the letter, group 3 the text
+    # Keep each marker's end too, so the question text can start right after it
+    question_heads = [m.span() for m in question_head_pattern.finditer(pdf_text)]
+    block_starts = [head_start for head_start, _ in question_heads]
+    block_ends = block_starts[1:] + [len(pdf_text)]
     
     json_output = []
     question_counter = 0
 
-    # Determine the section once from the start of the text
-    full_section_name, section_abbr = get_section_and_abbreviation(question_blocks[0] or "", exam)
+    # Determine the section once from the text before the first question
+    preamble = pdf_text[:block_starts[0]] if block_starts else pdf_text
+    full_section_name, section_abbr = get_section_and_abbreviation(preamble, exam)
     
-    for i, block in enumerate(question_blocks):
-        if not block.strip():
-            continue
+    for (block_start, head_end), block_end in zip(question_heads, block_ends):
+        block = pdf_text[block_start:block_end]
         
-        # Check if block starts with question marker
-        if exam == "CAT" and not block.strip().startswith('Q.'):
+        # For GATE, skip header blocks that don't have options (like "Q.1 – Q.5 Carry ONE mark Each")
+        if exam == "GATE" and ('(' not in block or not _GATE_OPTION_MARK_RE.search(block)):
             continue
-        elif exam == "GATE":
-            if not re.match(r'Q\.\s?\d+', block.strip()):
-                continue
-            # For GATE, skip header blocks that don't have options (like "Q.1 – Q.5 Carry ONE mark Each")
-            if '(' not in block or not re.search(r'\([A-D]\)', block):
-                continue
 
         question_counter += 1
         
-        # Define regex patterns to find options based on exam type
-        if exam == "CAT":
-            # CAT formats: A. text, [1] text, a) text, 1. text
-            option_pattern = re.compile(
-                r'(\n(?:[A-D]\)|[A-D]\.|\[[1-4]\]|[a-d]\))\s)(.*?)(?=\n(?:[A-D]\)|[A-D]\.|\[[1-4]\]|[a-d]\))|\Z)', 
-                re.DOTALL
-            )
-        else:  # GATE
-            # GATE formats: (A) text, (B) text, (C) text, (D) text
-            option_pattern = re.compile(
-                r'(\n?\s*\(([A-D])\)\s*)(.*?)(?=\s*\([A-D]\)|\Z)', 
-                re.DOTALL
-            )
-        
-        options = option_pattern.findall(block)
+        options = list(option_pattern.finditer(block))
         
-        # The question text is everything before the first option starts
-        first_option_pos = -1
+        # The question text runs from the end of the question number marker to
+        # the start of the first option (or the end of the block)
+        question_text_start = head_end - block_start
         if options:
-            if exam == "CAT":
-                first_option_full_match = options[0][0] + options[0][1]
-            else:  # GATE
-                first_option_full_match = options[0][0]
-            first_option_pos = block.find(first_option_full_match)
-
-        if first_option_pos != -1:
-            question_text_raw = block[:first_option_pos]
+            question_text_cleaned = block[question_text_start:options[0].start()].strip()
         else:
-            question_text_raw = block
-
-        # Clean question text based on format
-        if exam == "CAT":
-            question_text_cleaned = re.sub(r'^Q\.\s?\d+\)\s*', '', question_text_raw).strip()
-        else:  # GATE
-            question_text_cleaned = re.sub(r'^Q\.\s?\d+\s*', '', question_text_raw).strip()
+            question_text_cleaned = block[question_text_start:].strip()
         
         # If the block contains a new section header, update it
         current_section_name, current_section_abbr = get_section_and_abbreviation(block, exam)
@@ -162,7 +235,7 @@ def convert_questions_to_json(pdf_filepath):
             "year": year,
             "slot": slot,
             "section": section_abbr,
-            "question_text": question_text_cleaned.replace('\n', ' ').strip()
+            "question_text": _WS_RE.sub(' ', question_text_cleaned).strip()
         }
         
         # Add stream for GATE questions
@@ -171,11 +244,7 @@ def convert_questions_to_json(pdf_filepath):
         
         # Populate options into the desired format (option1, option2...)
         for idx, opt in enumerate(options[:4]):
-            if exam == "CAT":
-                option_text = opt[1].replace('\n', ' ').strip()
-            else:  # GATE - opt[2] contains the text, opt[1] contains the letter
-                option_text = opt[2].replace('\n', ' ').strip()
-            question_data[f"option{idx+1}"] = option_text
+            question_data[f"option{idx+1}"] = _WS_RE.sub(' ', opt.group(option_text_group)).strip()
 
         json_output.append(question_data)
         
@@ -204,8 +273,7 @@ def process_pdf(pdf_path, output_dir):
         output_filename = os.path.splitext(base_filename)[0] + '.json'
         output_filepath = os.path.join(output_dir, output_filename)
         
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            json.dump(parsed_questions, f, indent=2, ensure_ascii=False)
+        write_questions_json(output_filepath, parsed_questions)
         print(f"-> Success: Parsed {len(parsed_questions)} questions. Output saved to {output_filepath}")
     else:
         print(f"-> Warning: No questions parsed from {os.path.basename(pdf_path)}.")
@@ -221,19 +289,33 @@ def process_exam_type(exam_type):
         print(f"No PDF files found in '{source_dir}'. Skipping {exam_type}.")
         return
     
-    all_questions = []
+    # Questions keyed by ID; a later PDF overwrites an earlier entry with the same ID,
+    # so the same paper saved under two filenames does not end up twice in the
+    # combined section files
+    questions_by_id = {}
     
-    # Step 1: Parse all PDFs and collect all questions into one list
-    for pdf_path in pdf_files:
-        print(f"Processing {os.path.basename(pdf_path)}...")
-        parsed_questions = convert_questions_to_json(pdf_path)
-        if parsed_questions:
-            all_questions.extend(parsed_questions)
-            print(f"-> Found {len(parsed_questions)} questions.")
-        else:
-            print(f"-> Warning: No questions parsed from {os.path.basename(pdf_path)}.")
+    # Step 1: Parse all PDFs in worker processes and collect the questions as each
+    # PDF's results arrive. Each PDF is parsed independently, so the CPU-bound
+    # extraction scales across cores; map() yields results in input order, keeping
+    # the output deterministic. A single PDF is parsed in-process, as a pool would
+    # only add start-up cost.
+    max_workers = min(os.cpu_count() or 1, MAX_PARSE_WORKERS, len(pdf_files))
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        results = executor.map(convert_questions_to_json, pdf_files) if executor else map(convert_questions_to_json, pdf_files)
+        for pdf_path, parsed_questions in zip(pdf_files, results):
+            print(f"Processed {os.path.basename(pdf_path)}...")
+            if parsed_questions:
+                for question in parsed_questions:
+                    questions_by_id[question["id"]] = question
+                print(f"-> Found {len(parsed_questions)} questions.")
+            else:
+                print(f"-> Warning: No questions parsed from {os.path.basename(pdf_path)}.")
+    finally:
+        if executor:
+            executor.shutdown()
 
-    if not all_questions:
+    if not questions_by_id:
         print(f"No questions found for {exam_type}.")
         return
 
@@ -243,9 +325,9 @@ def process_exam_type(exam_type):
     else:  # GATE
         sections_map = {"GA": [], "TECH": []}
         # For GATE, also group by stream
-        streams_map = defaultdict(lambda: {"GA": [], "TECH": []})
+        streams_map = {}
 
-    for question in all_questions:
+    for question in questions_by_id.values():
         section = question.get("section")
         if exam_type == "CAT":
             if section in sections_map:
@@ -255,7 +337,7 @@ def process_exam_type(exam_type):
             if section in ["GA", "TECH"]:
                 sections_map[section].append(question)
                 if stream:
-                    streams_map[stream][section].append(question)
+                    streams_map.setdefault(stream, {"GA": [], "TECH": []})[section].append(question)
 
     # Step 3: Write the grouped questions into section-specific JSON files
     os.makedirs(output_dir, exist_ok=True)
@@ -268,10 +350,9 @@ def process_exam_type(exam_type):
             output_filepath = os.path.join(output_dir, output_filename)
             
             # Sort questions by year, then slot, then ID for consistency
-            questions.sort(key=lambda q: (q.get('year', 0), q.get('slot', 0), q.get('id', '')))
+            questions.sort(key=_SORT_KEY)
 
-            with open(output_filepath, 'w', encoding='utf-8') as f:
-                json.dump(questions, f, indent=2, ensure_ascii=False)
+            write_questions_json(output_filepath, questions)
             
             print(f"-> Success: Saved {len(questions)} {section} questions to {output_filepath}")
 
@@ -283,10 +364,9 @@ def process_exam_type(exam_type):
                     output_filename = f"GATE_{stream}_{section}_all_years_combined.json"
                     output_filepath = os.path.join(output_dir, output_filename)
                     
-                    questions.sort(key=lambda q: (q.get('year', 0), q.get('slot', 0), q.get('id', '')))
+                    questions.sort(key=_SORT_KEY)
 
-                    with open(output_filepath, 'w', encoding='utf-8') as f:
-                        json.dump(questions, f, indent=2, ensure_ascii=False)
+                    write_questions_json(output_filepath, questions)
                     
                     print(f"-> Success: Saved {len(questions)} {stream}-{section} questions to {output_filepath}")
 
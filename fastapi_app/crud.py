@@ -1,17 +1,75 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, lambda_stmt, select
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from . import models, schema, security
+from collections import OrderedDict
 import datetime
+import threading
+import time
 from typing import List
 
+# --- User Lookup Cache ---
+# Every authenticated request resolves the token's email to a user. Column values
+# of recently seen users are cached per worker process for a short TTL, so those
+# lookups skip the database; changes to a user can take up to the TTL to show.
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_SIZE = 10_000
+_USER_COLUMNS = [column.key for column in models.User.__table__.columns]
+_user_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+_user_cache_lock = threading.Lock()
+
 # --- User CRUD Functions ---
 
-def get_user_by_email(db: Session, email: str):
+def get_user_by_email(db: Session, email: str, with_subscription: bool = False):
     """
     Retrieves a single user from the database based on their email address.
+    With with_subscription, the one-to-one subscription is joined into the same
+    query instead of being lazy-loaded by a second SELECT on first access.
     """
-    return db.query(models.User).filter(models.User.email == email).first()
+    # lambda_stmt caches the statement construction as well as its compiled SQL,
+    # so repeated lookups only bind the email parameter
+    stmt = lambda_stmt(lambda: select(models.User).where(models.User.email == email))
+    if with_subscription:
+        stmt += lambda s: s.options(joinedload(models.User.subscription))
+    return db.execute(stmt).scalars().first()
 
-def create_user(db: Session, user: schema.UserCreate, role: models.UserRole = models.UserRole.USER):
+def get_user_by_email_cached(db: Session, email: str):
+    """
+    Like get_user_by_email, but served from the in-process user cache when
+    possible. The returned user is attached to the given session.
+    """
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(email)
+        if entry and entry[0] > now:
+            _user_cache.move_to_end(email)
+            values = entry[1]
+        else:
+            values = None
+
+    if values is not None:
+        # Rebuild the row as a detached instance and attach it without a SELECT
+        user = models.User(**values)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    user = get_user_by_email(db, email)
+    if user is not None:
+        values = {key: getattr(user, key) for key in _USER_COLUMNS}
+        with _user_cache_lock:
+            _user_cache[email] = (now + USER_CACHE_TTL_SECONDS, values)
+            _user_cache.move_to_end(email)
+            while len(_user_cache) > USER_CACHE_MAX_SIZE:
+                _user_cache.popitem(last=False)
+    return user
+
+def invalidate_cached_user(email: str):
+    """Drops a user from the in-process cache after it is created or modified."""
+    with _user_cache_lock:
+        _user_cache.pop(email, None)
+
+def create_user(db: Session, user: schema.UserCreate, role: models.UserRole = models.UserRole.USER,
+                hashed_password: str | None = None):
     """
     Creates a new user in the database with a specified role.
     
@@ -19,11 +77,14 @@ def create_user(db: Session, user: schema.UserCreate, role: models.UserRole = mo
         db (Session): The database session.
         user (schemas.UserCreate): The Pydantic schema containing user creation data.
         role (models.UserRole): The role to assign to the new user.
+        hashed_password (str | None): A hash already computed by the caller
+            (e.g. off the event loop); the password is hashed here otherwise.
         
     Returns:
         models.User: The newly created user object.
     """
-    hashed_password = security.get_password_hash(user.password)
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(user.password)
     
     # Create a new SQLAlchemy User model instance, now including the role
     db_user = models.User(
@@ -33,9 +94,11 @@ def create_user(db: Session, user: schema.UserCreate, role: models.UserRole = mo
         role=role
     )
     
+    # The INSERT returns the generated id, and the session does not expire the
+    # object on commit, so no refresh SELECT is needed
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
+    invalidate_cached_user(db_user.email)
     return db_user
 
 # --- Exam Attempt CRUD Functions ---
@@ -52,7 +115,6 @@ def create_exam_attempt(db: Session, user: models.User, submission: schema.ExamS
     )
     db.add(attempt)
     db.commit()
-    db.refresh(attempt)
     return attempt
 
 def get_exam_attempts(db: Session, user: models.User, limit: int = 20) -> List[models.ExamAttempt]:
@@ -66,32 +128,45 @@ def get_exam_attempts(db: Session, user: models.User, limit: int = 20) -> List[m
 
 # --- Subscription CRUD Functions ---
 
-def get_subscription_by_user_id(db: Session, user_id: int):
-    """
-    Retrieves a user's subscription from the database.
-    """
-    return db.query(models.Subscription).filter(models.Subscription.user_id == user_id).first()
-
 def create_or_update_subscription(db: Session, user_id: int, payment_customer_id: str, is_active: bool, expires_at: datetime):
     """
     Creates a new subscription for a user or updates their existing one.
+    Uses a single INSERT ... ON CONFLICT (user_id) DO UPDATE, relying on the
+    unique constraint on subscriptions.user_id, instead of a SELECT followed by
+    an INSERT or UPDATE.
     """
-    db_subscription = get_subscription_by_user_id(db, user_id=user_id)
-    
-    if db_subscription:
-        db_subscription.is_active = is_active
-        db_subscription.expires_at = expires_at
-        db_subscription.payment_customer_id = payment_customer_id
-    else:
-        db_subscription = models.Subscription(
-            user_id=user_id,
-            payment_customer_id=payment_customer_id,
-            is_active=is_active,
-            expires_at=expires_at
-        )
-        db.add(db_subscription)
-        
+    stmt = pg_insert(models.Subscription).values(
+        user_id=user_id,
+        payment_customer_id=payment_customer_id,
+        is_active=is_active,
+        expires_at=expires_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Subscription.user_id],
+        set_={
+            # Renewal events often carry no customer id; keep the stored one then
+            "payment_customer_id": func.coalesce(stmt.excluded.payment_customer_id, models.Subscription.payment_customer_id),
+            "is_active": stmt.excluded.is_active,
+            "expires_at": stmt.excluded.expires_at,
+        }
+    ).returning(models.Subscription)
+
+    db_subscription = db.scalars(stmt, execution_options={"populate_existing": True}).one()
     db.commit()
-    db.refresh(db_subscription)
     return db_subscription
 
+# --- Webhook Event CRUD Functions ---
+
+def record_webhook_event(db: Session, event_id: str) -> bool:
+    """
+    Records a webhook event id with INSERT ... ON CONFLICT DO NOTHING.
+    Returns False if the event was already recorded (a replay). Does not commit:
+    the caller commits it together with the event's own changes, so a failed
+    event is not marked as processed.
+    """
+    stmt = pg_insert(models.WebhookEvent).values(
+        event_id=event_id
+    ).on_conflict_do_nothing(
+        index_elements=[models.WebhookEvent.event_id]
+    ).returning(models.WebhookEvent.event_id)
+    return db.execute(stmt).first() is not None
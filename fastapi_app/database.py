@@ -8,10 +8,24 @@ from .config import settings
 DATABASE_URL = settings.DATABASE_URL
 
 # --- 2. SQLAlchemy Engine ---
-engine = create_engine(DATABASE_URL)
+# Each request checks a connection out of this pool; the defaults (5 connections,
+# no liveness check) run dry under concurrent requests and hand out dead
+# connections after the database restarts
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    # Reuse the most recently returned connection, so a small hot set stays warm
+    # and surplus idle connections age out via pool_recycle
+    pool_use_lifo=True,
+)
 
 # --- 3. Session Factory ---
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Sessions live for a single request, so objects are not expired on commit;
+# otherwise reading a just-written row (e.g. to build the response) costs a SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # --- 4. Declarative Base ---
 # Base is DEFINED here. Other files (like models.py) will import it from this file.
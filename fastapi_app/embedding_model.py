@@ -0,0 +1,48 @@
+import importlib.util
+import platform
+
+# Shared by the vector DB build (data_pipeline/scripts/build_vector_db.py) and the
+# RAG service, so stored and query embeddings come from the same model setup.
+# torch and sentence_transformers are slow to import, so they are imported on use.
+
+# --- Configuration ---
+MODEL_NAME = 'all-MiniLM-L6-v2' # A good starting model
+# Dynamically quantised int8 ONNX exports published with the model, per CPU family
+ONNX_MODEL_FILE_ARM64 = 'onnx/model_qint8_arm64.onnx'
+ONNX_MODEL_FILE_X86 = 'onnx/model_quint8_avx2.onnx'
+
+def onnx_model_file():
+    """Returns the int8 ONNX export built for this machine's CPU."""
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        return ONNX_MODEL_FILE_ARM64
+    return ONNX_MODEL_FILE_X86
+
+def onnx_backend_available():
+    """sentence-transformers' ONNX backend needs the optional optimum and onnxruntime packages."""
+    return all(importlib.util.find_spec(name) is not None for name in ('optimum', 'onnxruntime'))
+
+def load_embedding_model():
+    """
+    Loads the sentence transformer for the fastest backend on this machine:
+    PyTorch in fp16 on a GPU, otherwise the int8 ONNX Runtime export on CPU when
+    its packages are installed, and fp32 PyTorch on CPU otherwise.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Loading sentence transformer model: {MODEL_NAME} (device: {device})...")
+    if device == "cuda":
+        return SentenceTransformer(MODEL_NAME, device=device).half()
+
+    if onnx_backend_available():
+        try:
+            return SentenceTransformer(
+                MODEL_NAME,
+                device=device,
+                backend="onnx",
+                model_kwargs={"file_name": onnx_model_file()}
+            )
+        except Exception as e:
+            print(f"Could not load the ONNX model ({e}). Falling back to PyTorch.")
+    return SentenceTransformer(MODEL_NAME, device=device)
@@ -1,18 +1,35 @@
+from sqlalchemy import text
 from fastapi_app.database import engine, Base
 from fastapi_app import models
 
-print("Connecting to the database to create tables...")
-
-try:
+def create_tables():
+    """
+    Creates any missing tables and applies the in-place column additions
+    that create_all cannot make to existing tables.
+    """
+    with engine.connect() as connection:
+        connection.execute(text("ALTER TABLE IF EXISTS users ADD COLUMN IF NOT EXISTS full_name VARCHAR"))
+        connection.commit()
     # This command inspects all the classes that inherit from Base (your User and Subscription models)
     # and creates the corresponding tables in the database.
     Base.metadata.create_all(bind=engine)
-    
-    print("\n------------------------------------------------------")
-    print("Tables 'users' and 'subscriptions' created successfully.")
-    print("You can now start the main application.")
-    print("------------------------------------------------------")
+    # create_all only adds indexes along with new tables; add later ones to existing tables
+    with engine.connect() as connection:
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_users_email_hash ON users USING hash (email)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_subscriptions_active_expires ON subscriptions (is_active, expires_at)"))
+        connection.commit()
+
+if __name__ == "__main__":
+    print("Connecting to the database to create tables...")
+
+    try:
+        create_tables()
+        
+        print("\n------------------------------------------------------")
+        print("Tables 'users' and 'subscriptions' created successfully.")
+        print("You can now start the main application.")
+        print("------------------------------------------------------")
 
-except Exception as e:
-    print(f"An error occurred while creating tables: {e}")
-    print("Please check your database connection details in the .env file and ensure the PostgreSQL server is running.")
+    except Exception as e:
+        print(f"An error occurred while creating tables: {e}")
+        print("Please check your database connection details in the .env file and ensure the PostgreSQL server is running.")
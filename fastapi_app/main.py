@@ -1,19 +1,19 @@
+import asyncio
 from fastapi import FastAPI, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 
 # Import all the necessary modules from your application structure
-from . import crud, models, schema, security, payments, database
+from . import crud, models, schema, security, payments, database, init_db
+from .config import settings
 from .rag_service import RAGService
-# Create the database tables if they don't exist
-try:
-    with database.engine.connect() as connection:
-        connection.execute(text("ALTER TABLE IF EXISTS users ADD COLUMN IF NOT EXISTS full_name VARCHAR"))
-        connection.commit()
-    models.Base.metadata.create_all(bind=database.engine)
-    print("Database tables checked/created successfully.")
-except Exception as e:
-    print(f"Error creating database tables: {e}")
+# Create the database tables if they don't exist (development only; see AUTO_CREATE_TABLES)
+if settings.AUTO_CREATE_TABLES:
+    try:
+        init_db.create_tables()
+        print("Database tables checked/created successfully.")
+    except Exception as e:
+        print(f"Error creating database tables: {e}")
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
@@ -32,22 +32,35 @@ app = FastAPI(
 # --- Authentication Endpoints ---
 
 @app.post("/register", response_model=schema.User, status_code=status.HTTP_201_CREATED, tags=["Authentication"])
-def register_user(user: schema.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+async def register_user(user: schema.UserCreate, db: Session = Depends(database.get_db)):
+    # Hash on the bounded hashing pool, then run the blocking INSERT in a worker
+    # thread, so the event loop stays free throughout
+    hashed_password = await security.get_password_hash_async(user.password)
+    # The unique constraint on users.email rejects duplicates, so new sign-ups
+    # need no separate existence check
+    try:
+        return await asyncio.to_thread(crud.create_user, db, user, hashed_password=hashed_password)
+    except IntegrityError:
+        await asyncio.to_thread(db.rollback)
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
 
 @app.post("/token", response_model=schema.Token, tags=["Authentication"])
 def login_for_access_token(form_data: schema.OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
     user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = security.verify_and_update_password(form_data.password, user.hashed_password) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade legacy (bcrypt) hashes now that we have the plain-text password
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+        crud.invalidate_cached_user(user.email)
+    
     access_token = security.create_access_token(
         data={
             "sub": user.email,
@@ -124,8 +137,10 @@ async def generate_new_exam(
     try:
         print(f"Generating new {request.exam_name} exam for user: {current_user.email}")
         
-        # Create appropriate RAG service instance based on exam type
-        rag_service = RAGService(request.exam_name)
+        # Create appropriate RAG service instance based on exam type. Construction
+        # loads the embedding model, vector DB and question files synchronously,
+        # so it runs in a worker thread to keep the event loop serving requests.
+        rag_service = await asyncio.to_thread(RAGService, request.exam_name)
         
         # Pass the request parameters to the RAG service
         generated_exam = await rag_service.generate_full_exam(
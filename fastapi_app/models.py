@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum as SQLAlchemyEnum, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum as SQLAlchemyEnum, JSON, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -15,6 +15,12 @@ class User(Base):
     Now includes a 'role' to distinguish between regular users and admins.
     """
     __tablename__ = "users"
+    # Every authenticated request looks a user up by exact email; a hash index
+    # serves that equality lookup, while the unique btree on email keeps
+    # enforcing uniqueness (Postgres hash indexes cannot be unique)
+    __table_args__ = (
+        Index("ix_users_email_hash", "email", postgresql_using="hash"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -25,8 +31,11 @@ class User(Base):
     role = Column(SQLAlchemyEnum(UserRole), nullable=False, default=UserRole.USER)
 
     # This creates a one-to-one relationship with the Subscription model.
-    subscription = relationship("Subscription", back_populates="user", uselist=False, cascade="all, delete-orphan")
-    exam_attempts = relationship("ExamAttempt", back_populates="user", cascade="all, delete-orphan")
+    # Loading is explicit: the subscription is only needed by the subscriber check,
+    # which joins it into the user query (crud.get_user_by_email(with_subscription=True)),
+    # so other user loads don't pay for it.
+    subscription = relationship("Subscription", back_populates="user", uselist=False, lazy="select", cascade="all, delete-orphan")
+    exam_attempts = relationship("ExamAttempt", back_populates="user", lazy="select", cascade="all, delete-orphan")
 
 class Subscription(Base):
     """
@@ -34,14 +43,19 @@ class Subscription(Base):
     This table will track the subscription status for each user.
     """
     __tablename__ = "subscriptions"
+    # Supports queries over active/expiring subscriptions (e.g. admin reports)
+    __table_args__ = (
+        Index("ix_subscriptions_active_expires", "is_active", "expires_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
     payment_customer_id = Column(String, unique=True, index=True, nullable=True)
     is_active = Column(Boolean, default=False)
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)  # naive UTC
     
-    user = relationship("User", back_populates="subscription")
+    # Never navigated from this side; raise instead of silently issuing a query
+    user = relationship("User", back_populates="subscription", lazy="raise")
 
 class ExamAttempt(Base):
     """
@@ -58,5 +72,14 @@ class ExamAttempt(Base):
     submitted_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
     exam_data = Column(JSON, nullable=False)
 
-    user = relationship("User", back_populates="exam_attempts")
+    user = relationship("User", back_populates="exam_attempts", lazy="raise")
 
+class WebhookEvent(Base):
+    """
+    Records the ids of processed payment webhook events. Providers retry
+    deliveries, so a replayed event id is recognised and skipped.
+    """
+    __tablename__ = "webhook_events"
+
+    event_id = Column(String, primary_key=True)
+    received_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
@@ -1,7 +1,9 @@
 import razorpay
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
 import hmac
 import hashlib
 
@@ -63,7 +65,12 @@ def create_razorpay_order(
 
 
 @router.post("/razorpay_webhook")
-async def razorpay_webhook(request: Request, x_razorpay_signature: str = Header(None), db: Session = Depends(database.get_db)):
+async def razorpay_webhook(
+    request: Request,
+    x_razorpay_signature: str = Header(None),
+    x_razorpay_event_id: str = Header(None),
+    db: Session = Depends(database.get_db),
+):
     """
     Webhook endpoint to receive events from Razorpay.
     This is used to update the user's subscription status after a successful payment.
@@ -83,36 +90,64 @@ async def razorpay_webhook(request: Request, x_razorpay_signature: str = Header(
         raise HTTPException(status_code=500, detail=f"Webhook verification failed: {e}")
 
     # --- Process the Event ---
+    # The database work is synchronous, so it runs in a worker thread to keep the
+    # event loop free
     try:
         event_data = await request.json()
-        event_type = event_data.get('event')
-
-        # Handle the payment.captured event
-        if event_type == 'payment.captured':
-            payment_entity = event_data['payload']['payment']['entity']
-            user_id = payment_entity.get('notes', {}).get('user_id')
-
-            if user_id:
-                # --- Logic to update subscription ---
-                user_id = int(user_id)
-                
-                # For simplicity, we'll set the expiration to 31 days from now.
-                expires_at = datetime.now() + timedelta(days=31)
-
-                crud.create_or_update_subscription(
-                    db=db,
-                    user_id=user_id,
-                    stripe_customer_id=None, # This field is Stripe-specific; can be ignored or reused
-                    is_active=True,
-                    expires_at=expires_at
-                )
-                print(f"Successfully updated subscription for user_id: {user_id} via Razorpay.")
-
+        processed = await asyncio.to_thread(_process_webhook_event, db, x_razorpay_event_id, event_data)
+    except (IntegrityError, KeyError, ValueError, TypeError, AttributeError) as e:
+        # A malformed payload or an unknown user_id fails the same way on every
+        # delivery, so acknowledge it rather than have Razorpay retry it
+        await asyncio.to_thread(db.rollback)
+        print(f"Ignoring unprocessable Razorpay webhook event {x_razorpay_event_id}: {e!r}")
+        return {"status": "ignored"}
     except Exception as e:
-        # It's important to log the error but return a 200 to Razorpay
-        # to prevent them from repeatedly sending the same webhook.
+        await asyncio.to_thread(db.rollback)
         print(f"Error processing Razorpay webhook payload: {e}")
-        return {"status": "error during processing"}
-            
+        # Transient failure (e.g. the database is unreachable); the event was not
+        # recorded, and a 5xx makes Razorpay redeliver it later
+        raise HTTPException(status_code=500, detail="Error processing webhook event.")
+
+    if not processed:
+        print(f"Skipping duplicate Razorpay webhook event: {x_razorpay_event_id}")
+        return {"status": "duplicate"}
     return {"status": "success"}
 
+
+def _process_webhook_event(db: Session, event_id: str | None, event_data: dict) -> bool:
+    """
+    Applies a verified webhook event in a single transaction: the event id is
+    recorded and the subscription updated together. Returns False, changing
+    nothing, if the event id was already processed.
+    """
+    # Razorpay retries deliveries with the same event id; a replay is a single
+    # failed PK insert and leaves subscriptions untouched
+    if event_id and not crud.record_webhook_event(db, event_id):
+        db.rollback()
+        return False
+
+    # Handle the payment.captured event
+    if event_data.get('event') == 'payment.captured':
+        payment_entity = event_data['payload']['payment']['entity']
+        user_id = payment_entity.get('notes', {}).get('user_id')
+
+        if user_id:
+            # --- Logic to update subscription ---
+            user_id = int(user_id)
+
+            # For simplicity, we'll set the expiration to 31 days from now.
+            # Expiry times are stored as naive UTC, like the other timestamps.
+            expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=31)
+
+            crud.create_or_update_subscription(
+                db=db,
+                user_id=user_id,
+                payment_customer_id=payment_entity.get('customer_id'),
+                is_active=True,
+                expires_at=expires_at
+            )
+            print(f"Successfully updated subscription for user_id: {user_id} via Razorpay.")
+
+    # Commits the event record (the subscription upsert above commits it too)
+    db.commit()
+    return True
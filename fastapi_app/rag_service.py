@@ -1,15 +1,40 @@
 import chromadb
-from sentence_transformers import SentenceTransformer
 import json
 import os
 import random
 import asyncio
-import google.generativeai as genai
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
+from itertools import product
+
+from .embedding_model import load_embedding_model
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+# sentence_transformers (torch) and google.generativeai are slow to import, so they
+# are imported on first use rather than whenever the API imports this module
 
 # --- Configuration ---
 BASE_APP_DATA_PATH = '/Users/vaibhav.yadav/Documents/Course/OELP/app_data'
-MODEL_NAME = 'all-MiniLM-L6-v2'
+# Seed questions embedded per forward pass; covers a whole section in one batch
+QUERY_ENCODE_BATCH_SIZE = 64
+# Generation settings shared by every Gemini request
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 4096,
+    "response_mime_type": "application/json"
+}
+# Gemini requests allowed per minute, shared by all exams generated in this process.
+# The default covers the largest section (55 GATE technical questions), so no exam
+# waits longer than the old flow of one section per minute; lower it to match a
+# smaller API quota, at the cost of slower exams.
+GEMINI_REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "55"))
 
 def get_exam_paths(exam_type):
     """Get paths for vector DB, questions, and generated exams based on exam type"""
@@ -52,6 +77,98 @@ SECTION_FILENAME_MAP = {
     "technical": "TECH"
 }
 
+class AsyncRateLimiter:
+    """
+    Sliding-window rate limiter for asyncio: at most `rate` acquisitions in any
+    `period` seconds, so a per-minute quota holds over every window. Waiters are
+    served in arrival order.
+    """
+    def __init__(self, rate, period=60.0):
+        self.rate = rate
+        self.period = period
+        self._calls = deque()
+        # asyncio locks bind to the loop that first uses them, and scripts may run
+        # several loops in turn (e.g. repeated asyncio.run calls), so the lock is
+        # created for the running loop
+        self._lock = None
+        self._lock_loop = None
+
+    def _get_lock(self):
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def acquire(self):
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.rate:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self._calls[0] + self.period - now)
+
+# Gemini models shared by every RAGService in the process, keyed by (API key, model
+# name). genai.configure() discards the SDK's cached API clients and with them their
+# open connections, so it only runs when the key changes, not for every new service.
+_gemini_models = {}
+_gemini_configured_key = None
+
+# Source questions and seed indexes by exam, with the (mtime, size) of each source
+# file. main.py builds a new RAGService per request; while the files are unchanged
+# they reuse the parsed data instead of reading and indexing it again.
+_source_data_cache = {}
+
+# One limiter per process: a new RAGService is created for each API request, but
+# they all share the same Gemini quota
+_gemini_rate_limiter = AsyncRateLimiter(GEMINI_REQUESTS_PER_MINUTE)
+
+# The embedding model is loaded once per process and shared by every RAGService;
+# main.py builds a new service for each request
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+# The shared model's fast tokenizer is not safe to call from several threads at
+# once ("Already borrowed"), so encode calls from request threads take turns
+_embedding_encode_lock = threading.Lock()
+
+def get_embedding_model():
+    """Returns the process-wide embedding model, loading it on first use."""
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            _embedding_model = load_embedding_model()
+        return _embedding_model
+
+@lru_cache(maxsize=None)
+def _prompt_template(section, q_type):
+    """
+    Returns the fixed prompt text before and after the context questions for a
+    section and question type; built once per pair rather than per question.
+    """
+    question_type_instruction = (
+        "an MCQ (Multiple Choice Question) with 4 options labeled 'option1' to 'option4'" if q_type == 'mcq'
+        else "a TITA (Type In The Answer) question where the answer is a numerical value or short text"
+    )
+
+    head = f"""
+        You are an expert question setter for the CAT (Common Admission Test) exam.
+        Your task is to generate a new, original question for the '{SECTION_FILENAME_MAP.get(section, section.upper())}' section.
+        The question must be of type: {question_type_instruction}.
+        It should be of a similar style, topic, and difficulty level to the following examples:
+        ---
+        """
+    tail = """
+        ---
+        Your entire response MUST be a single, valid JSON object. Do not include any other text, markdown, or explanation.
+        The JSON object must have the following structure:
+        - For MCQ: {"question_text": "...", "option1": "...", "option2": "...", "option3": "...", "option4": "...", "answer": "The correct option text", "explanation": "A brief explanation."}
+        - For TITA: {"question_text": "...", "answer": "The numerical or short text answer", "explanation": "A brief explanation."}
+        """
+    return head, tail
+
 class RAGService:
     def __init__(self, exam_type="CAT"):
         self.exam_type = exam_type.upper()
@@ -66,6 +183,8 @@ class RAGService:
         os.makedirs(self.paths['generated_exams'], exist_ok=True)
         
         self.client = chromadb.PersistentClient(path=self.paths['vector_db'])
+        # Collection handles, cached by name (GATE technical collections are per stream)
+        self._collections = {}
 
         # Diagnostic check for existing collections
         print("\n--- Vector DB Collection Summary ---")
@@ -80,10 +199,9 @@ class RAGService:
             print("Please ensure the vector database has been built correctly.")
         print("------------------------------------\n")
 
-        print(f"Loading sentence transformer model: {MODEL_NAME}")
-        self.model = SentenceTransformer(MODEL_NAME)
+        self.model = get_embedding_model()
 
-        self.source_questions = self._load_source_questions()
+        self._load_source_data()
 
         # Gemini model attributes (lazy initialization)
         self._gemini_model = None
@@ -102,6 +220,35 @@ class RAGService:
 
         print("RAG Service initialized successfully.")
 
+    def _source_file_path(self, section):
+        """Returns the path of a section's combined source-question JSON file."""
+        file_abbr = SECTION_FILENAME_MAP.get(section, section.upper())
+        file_name = f"{self.exam_type}_{file_abbr}_all_years_combined.json"
+        return os.path.join(self.paths['structured_questions'], file_name)
+
+    def _load_source_data(self):
+        """
+        Sets the source questions and seed index, reusing those parsed by an
+        earlier service in this process while the source files are unchanged.
+        """
+        signature = []
+        for section in SUPPORTED_EXAMS.get(self.exam_type, {}):
+            try:
+                stat = os.stat(self._source_file_path(section))
+                signature.append((section, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((section, None, None))
+
+        cache_key = (self.exam_type, self.paths['structured_questions'])
+        cached = _source_data_cache.get(cache_key)
+        if cached and cached[0] == signature:
+            self.source_questions, self._seed_index = cached[1], cached[2]
+            return
+
+        self.source_questions = self._load_source_questions()
+        self._seed_index = self._build_seed_index()
+        _source_data_cache[cache_key] = (signature, self.source_questions, self._seed_index)
+
     def _load_source_questions(self):
         """
         Loads all questions from the JSON files into memory for quick lookups.
@@ -111,15 +258,14 @@ class RAGService:
         exam_sections = SUPPORTED_EXAMS.get(self.exam_type, {}).keys()
         
         for section in exam_sections:
-            file_abbr = SECTION_FILENAME_MAP.get(section, section.upper())
-            file_name = f"{self.exam_type}_{file_abbr}_all_years_combined.json"
-            file_path = os.path.join(self.paths['structured_questions'], file_name)
+            file_path = self._source_file_path(section)
             
             if os.path.exists(file_path):
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        source_data[section] = data if isinstance(data, list) else []
+                    with open(file_path, 'rb') as f:
+                        raw = f.read()
+                    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+                    source_data[section] = data if isinstance(data, list) else []
                 except json.JSONDecodeError:
                     print(f"Warning: Could not decode JSON from {file_path}.")
                     source_data[section] = []
@@ -128,37 +274,65 @@ class RAGService:
                 print(f"Warning: Source JSON file not found at '{file_path}'")
         return source_data
 
+    def _build_seed_index(self):
+        """
+        Groups each section's questions by (type, exam, stream, year), once, so
+        seed lookups are a dict lookup instead of filtering the whole section.
+        Every question is added under each combination of its values and None
+        (meaning "not filtered on"); buckets hold references in source order.
+        """
+        index = {}
+        for section, questions in self.source_questions.items():
+            buckets = index[section] = {}
+            for q in questions:
+                q_type = 'mcq' if 'option1' in q else 'tita'
+                # A set, so a question whose value is already None (e.g. no year)
+                # is not added to the same bucket twice and picked twice as often
+                for key in set(product(((q.get('exam') or '').lower(), None),
+                                       ((q.get('stream') or '').lower(), None),
+                                       (q.get('year'), None))):
+                    buckets.setdefault((q_type, *key), []).append(q)
+        return index
+
     def _find_seed_question(self, section, q_type, exam_name, stream, year):
         """Finds a random question that matches the specified filters to seed the search."""
-        candidates = self.source_questions.get(section, [])
-        
-        # Filter by exam first
-        if exam_name:
-            candidates = [q for q in candidates if q.get('exam', '').lower() == exam_name.lower()]
-        
-        # For GATE, handle GA vs Technical sections differently
+        # For GATE, GA questions are shared across all streams and only technical
+        # questions are stream-specific; other exams filter by stream if provided
         if exam_name and exam_name.upper() == "GATE":
-            if section == "general_aptitude":
-                # GA questions are shared across all streams, don't filter by stream
-                pass
-            elif section == "technical" and stream:
-                # Technical questions are stream-specific
-                candidates = [q for q in candidates if q.get('stream', '').lower() == stream.lower()]
-        elif stream:
-            # For other exams, filter by stream if provided
-            candidates = [q for q in candidates if q.get('stream', '').lower() == stream.lower()]
-            
-        # Filter by year if provided
-        if year:
-            candidates = [q for q in candidates if q.get('year') == year]
+            filter_stream = section == "technical" and stream
+        else:
+            filter_stream = stream
+
+        key = (
+            'mcq' if q_type == 'mcq' else 'tita',
+            exam_name.lower() if exam_name else None,
+            stream.lower() if filter_stream else None,
+            year if year else None,
+        )
+        candidates = self._seed_index.get(section, {}).get(key)
+        return random.choice(candidates) if candidates else None
 
-        # Filter by question type
-        if q_type == 'mcq':
-            filtered = [q for q in candidates if 'option1' in q]
-        else: # TITA
-            filtered = [q for q in candidates if 'option1' not in q]
+    def _collection_name(self, section, stream):
+        """Returns the vector DB collection name for a section (and GATE stream)."""
+        # Handle collection naming for both CAT and GATE
+        if self.exam_type == "CAT":
+            collection_abbr = 'qa' if section == 'quant' else section
+            return f"cat_{collection_abbr}_all_years_combined"
+        if section == "technical":
+            # For GATE technical questions, use stream-specific collection
+            return f"gate_{stream.lower()}_technical_all_years_combined"
+        return "gate_ga_all_years_combined"  # general_aptitude
 
-        return random.choice(filtered) if filtered else None
+    def _get_collection(self, collection_name):
+        """
+        Returns the collection handle, fetching it from Chroma only on first use.
+        Missing collections are not cached, so they are found once they are built.
+        """
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            collection = self.client.get_collection(name=collection_name)
+            self._collections[collection_name] = collection
+        return collection
 
     def _ensure_gemini_model(self):
         """
@@ -173,10 +347,17 @@ class RAGService:
             print("Warning: GEMINI_API_KEY not set. Gemini generation is unavailable.")
             return None
 
+        global _gemini_configured_key
         model_name = os.environ.get("GEMINI_MODEL", self._gemini_model_name)
         try:
-            genai.configure(api_key=gemini_api_key)
-            self._gemini_model = genai.GenerativeModel(model_name)
+            gemini_model = _gemini_models.get((gemini_api_key, model_name))
+            if gemini_model is None:
+                import google.generativeai as genai
+                if _gemini_configured_key != gemini_api_key:
+                    genai.configure(api_key=gemini_api_key)
+                    _gemini_configured_key = gemini_api_key
+                gemini_model = _gemini_models[(gemini_api_key, model_name)] = genai.GenerativeModel(model_name)
+            self._gemini_model = gemini_model
             self._gemini_model_name = model_name
             return self._gemini_model
         except Exception as exc:
@@ -206,98 +387,80 @@ class RAGService:
 
         return "\n".join(parts).strip()
 
-    async def _generate_single_question(self, section, q_type, exam_name, stream, year):
-        """Generates one new question using the RAG pipeline with Gemini API."""
-        seed_question = self._find_seed_question(section, q_type, exam_name, stream, year)
-        if not seed_question:
-            return {"error": f"No seed questions found for {exam_name} {stream or ''} {year or ''} - {section} {q_type}"}
-
-        # Handle collection naming for both CAT and GATE
-        if self.exam_type == "CAT":
-            collection_abbr = 'qa' if section == 'quant' else section
-            collection_name = f"cat_{collection_abbr}_all_years_combined"
-        else:  # GATE
-            if section == "technical":
-                # For GATE technical questions, use stream-specific collection
-                collection_name = f"gate_{stream.lower()}_technical_all_years_combined"
-            else:  # general_aptitude
-                collection_name = f"gate_ga_all_years_combined"
+    async def _retrieve_contexts(self, section, stream, seed_questions):
+        """
+        Retrieves the 3 most similar stored questions for every seed question,
+        embedding all seeds in one batch and running one vector DB query.
+        Returns a list of context lists, one per seed, or an error dict.
+        """
+        collection_name = self._collection_name(section, stream)
+        try:
+            collection = self._get_collection(collection_name)
+
+            def _query():
+                # Embed all seeds with the loaded model in one batched forward pass,
+                # rather than Chroma's embedding function embedding them itself
+                with _embedding_encode_lock:
+                    query_embeddings = self.model.encode(
+                        [q['question_text'] for q in seed_questions],
+                        batch_size=QUERY_ENCODE_BATCH_SIZE,
+                        convert_to_numpy=True
+                    )
+                # fp16 on the GPU path; Chroma stores and compares float32 vectors
+                query_embeddings = query_embeddings.astype('float32', copy=False)
+                return collection.query(query_embeddings=query_embeddings, n_results=3)
+
+            retrieved_results = await asyncio.to_thread(_query)
+            return retrieved_results['documents']
+        except ValueError as e:
+            if "does not exist" in str(e):
+                return {"error": f"Vector DB collection '{collection_name}' not found. Please run the build script."}
+            return {"error": f"An exception occurred: {str(e)}"}
+        except Exception as e:
+            return {"error": f"An unexpected exception occurred: {str(e)}"}
 
+    async def _generate_single_question(self, section, q_type, context_questions):
+        """Generates one new question from its retrieved context questions with the Gemini API."""
         try:
-            collection = self.client.get_collection(name=collection_name)
-            retrieved_results = collection.query(
-                query_texts=[seed_question['question_text']],
-                n_results=3 
-            )
-            
-            context_questions = retrieved_results['documents'][0]
             prompt = self._create_llm_prompt(section, q_type, context_questions)
             
             gemini_model = self._ensure_gemini_model()
             if not gemini_model:
                 return {"error": "Gemini API Key not found. Please set the GEMINI_API_KEY environment variable."}
 
-            generation_config = {
-                "temperature": 0.7,
-                "max_output_tokens": 4096,
-                "response_mime_type": "application/json"
-            }
-
             def _invoke_gemini():
                 return gemini_model.generate_content(
                     prompt,
-                    generation_config=generation_config
+                    generation_config=GEMINI_GENERATION_CONFIG
                 )
 
             try:
+                await _gemini_rate_limiter.acquire()
                 response = await asyncio.to_thread(_invoke_gemini)
             except Exception as exc:
                 return {"error": f"Gemini API Error: {exc}"}
             llm_text = self._extract_gemini_text(response) or "{}"
 
             try:
-                generated_q = json.loads(llm_text)
+                generated_q = orjson.loads(llm_text) if orjson is not None else json.loads(llm_text)
                 generated_q['section'] = SECTION_FILENAME_MAP.get(section, section.upper())
                 generated_q['type'] = q_type.upper()
                 return generated_q
             except json.JSONDecodeError:
                 return {"error": "Failed to parse LLM JSON response", "raw_response": llm_text}
 
-        except ValueError as e:
-            if "does not exist" in str(e):
-                return {"error": f"Vector DB collection '{collection_name}' not found. Please run the build script."}
-            return {"error": f"An exception occurred: {str(e)}"}
         except Exception as e:
             return {"error": f"An unexpected exception occurred: {str(e)}"}
 
     def _create_llm_prompt(self, section, q_type, context_questions):
         """Constructs the prompt with instructions and context."""
-        question_type_instruction = (
-            "an MCQ (Multiple Choice Question) with 4 options labeled 'option1' to 'option4'" if q_type == 'mcq'
-            else "a TITA (Type In The Answer) question where the answer is a numerical value or short text"
-        )
-        
-        context_str = "\n---\n".join(context_questions)
-
-        prompt = f"""
-        You are an expert question setter for the CAT (Common Admission Test) exam.
-        Your task is to generate a new, original question for the '{SECTION_FILENAME_MAP.get(section, section.upper())}' section.
-        The question must be of type: {question_type_instruction}.
-        It should be of a similar style, topic, and difficulty level to the following examples:
-        ---
-        {context_str}
-        ---
-        Your entire response MUST be a single, valid JSON object. Do not include any other text, markdown, or explanation.
-        The JSON object must have the following structure:
-        - For MCQ: {{"question_text": "...", "option1": "...", "option2": "...", "option3": "...", "option4": "...", "answer": "The correct option text", "explanation": "A brief explanation."}}
-        - For TITA: {{"question_text": "...", "answer": "The numerical or short text answer", "explanation": "A brief explanation."}}
-        """
-        return prompt
+        head, tail = _prompt_template(section, q_type)
+        return head + "\n---\n".join(context_questions) + tail
 
     async def generate_full_exam(self, exam_name: str, stream: str | None = None, year: int | None = None):
         """
-        Orchestrates the generation of a full mock exam section by section
-        to respect API rate limits.
+        Orchestrates the generation of a full mock exam, keeping the Gemini
+        calls within the configured requests-per-minute limit.
         """
         exam_name_upper = exam_name.upper()
         
@@ -325,34 +488,46 @@ class RAGService:
                 "GA": [], "TECH": [], "errors": []
             }
 
-        sections_to_process = list(exam_structure.keys())
-
-        for i, section in enumerate(sections_to_process):
-            print(f"\n--- Generating section: {section.upper()} ---")
-            
-            tasks = []
-            structure = exam_structure[section]
+        # Seeds and their context are fetched section by section (one vector DB
+        # query each); the questions for all sections are then generated together,
+        # with the shared rate limiter pacing the Gemini calls
+        generated_questions, tasks = [], []
+        for section, structure in exam_structure.items():
+            print(f"\n--- Preparing section: {section.upper()} ---")
             
+            # Pick a seed question for every question to generate, then fetch the
+            # context for all of them with a single vector DB query
+            q_types, seed_questions = [], []
             for q_type, count in structure.items():
                 for _ in range(count):
-                    tasks.append(self._generate_single_question(section, q_type, exam_name, stream, year))
-            
-            generated_questions = await asyncio.gather(*tasks)
-
-            for q in generated_questions:
-                section_key = q.get('section')
-                if section_key and section_key in full_exam:
-                    full_exam[section_key].append(q)
-                elif "error" in q:
-                    full_exam["errors"].append(q)
+                    seed_question = self._find_seed_question(section, q_type, exam_name, stream, year)
+                    if seed_question:
+                        q_types.append(q_type)
+                        seed_questions.append(seed_question)
+                    else:
+                        generated_questions.append({"error": f"No seed questions found for {exam_name} {stream or ''} {year or ''} - {section} {q_type}"})
+
+            if seed_questions:
+                contexts = await self._retrieve_contexts(section, stream, seed_questions)
+                if isinstance(contexts, dict):
+                    generated_questions.extend(contexts for _ in seed_questions)
                 else:
-                    full_exam["errors"].append({"error": "Generated question has unknown section", "details": q})
-
-            print(f"--- Section {section.upper()} generation complete. ---")
-
-            if i < len(sections_to_process) - 1:
-                print(f"Waiting for 60 seconds to avoid rate limiting...")
-                await asyncio.sleep(60)
+                    tasks.extend(
+                        self._generate_single_question(section, q_type, context_questions)
+                        for q_type, context_questions in zip(q_types, contexts)
+                    )
+
+        print(f"\n--- Generating {len(tasks)} questions (up to {GEMINI_REQUESTS_PER_MINUTE} requests/minute) ---")
+        generated_questions.extend(await asyncio.gather(*tasks))
+
+        for q in generated_questions:
+            section_key = q.get('section')
+            if section_key and section_key in full_exam:
+                full_exam[section_key].append(q)
+            elif "error" in q:
+                full_exam["errors"].append(q)
+            else:
+                full_exam["errors"].append({"error": "Generated question has unknown section", "details": q})
         
         print("\nFull exam generation complete.")
         self._save_exam(full_exam)
@@ -367,8 +542,12 @@ class RAGService:
             file_name = f"{self.exam_type.lower()}_exam{stream_suffix}_{timestamp}.json"
             save_path = os.path.join(self.paths['generated_exams'], file_name)
 
-            with open(save_path, 'w', encoding='utf-8') as f:
-                json.dump(exam_data, f, indent=2)
+            if orjson is not None:
+                with open(save_path, 'wb') as f:
+                    f.write(orjson.dumps(exam_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(save_path, 'w', encoding='utf-8') as f:
+                    json.dump(exam_data, f, indent=2)
             
             print(f"Successfully saved generated exam to: {save_path}")
         except Exception as e:
@@ -3,22 +3,94 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from passlib.hash import bcrypt as bcrypt_hash
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import asyncio
+import os
+import threading
+import time
 
 from . import schema, database, models, crud, config
 
 # --- Password Hashing ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Passwords are hashed with bcrypt only, so the stored hash format never depends
+# on which optional packages a host happens to have installed.
+# Default cost, and the candidates tried (cheapest first) when autotuning
+BCRYPT_ROUNDS = 12
+BCRYPT_ROUNDS_CANDIDATES = [10, 11, 12, 13, 14]
+
+def _pick_hash_cost(candidates, hash_with_cost, target_ms):
+    """
+    Returns the largest candidate cost whose median hashing time (over 3 runs)
+    stays within target_ms, or the cheapest candidate if none does.
+    """
+    chosen = candidates[0]
+    for cost in candidates:
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            hash_with_cost(cost)
+            timings.append((time.perf_counter() - start) * 1000)
+        if sorted(timings)[1] > target_ms:
+            break
+        chosen = cost
+    return chosen
+
+def _create_pwd_context():
+    """Builds the passlib context, benchmarking the hash cost first if enabled."""
+    bcrypt_rounds = BCRYPT_ROUNDS
+    if config.settings.PASSWORD_HASH_AUTOTUNE:
+        target_ms = config.settings.PASSWORD_HASH_TARGET_MS
+        bcrypt_rounds = _pick_hash_cost(
+            BCRYPT_ROUNDS_CANDIDATES,
+            lambda cost: bcrypt_hash.using(rounds=cost).hash("benchmark"),
+            target_ms,
+        )
+        print(f"Password hashing: bcrypt rounds={bcrypt_rounds} (target {target_ms} ms)")
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=bcrypt_rounds)
+
+pwd_context = _create_pwd_context()
+# passlib picks and loads the backend on its first use; do it at import so the
+# first register/login request does not pay for it
+pwd_context.handler("bcrypt").get_backend()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain-text password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    except ValueError:  # not a bcrypt hash (passlib's UnknownHashError)
+        return False
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Verifies a password and, if its hash uses outdated settings (e.g. a lower
+    bcrypt cost), returns a replacement hash to store (otherwise None).
+    A hash in an unrecognised format fails verification instead of raising.
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except ValueError:  # not a bcrypt hash (passlib's UnknownHashError)
+        return False, None
 
 def get_password_hash(password: str) -> str:
-    """Hashes a plain-text password using bcrypt."""
+    """Hashes a plain-text password with bcrypt."""
     return pwd_context.hash(password)
 
+# Hashing is deliberately slow, so async callers share a small dedicated pool: a
+# burst of sign-ups queues here instead of blocking the event loop or running
+# unbounded hashes in parallel.
+HASH_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_MAX_WORKERS, thread_name_prefix="password-hash")
+
+async def get_password_hash_async(password: str) -> str:
+    """Hashes a password on the bounded hashing pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, pwd_context.hash, password)
+
 # --- JWT Token Functions ---
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -33,35 +105,79 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, config.settings.SECRET_KEY, algorithm=config.settings.ALGORITHM)
     return encoded_jwt
 
+# --- Decoded Token Cache ---
+# Clients send the same bearer token on every request; the email it resolves to is
+# remembered (never past the token's own expiry) so repeat requests skip jwt.decode
+# and the claim validation. The user row itself comes from crud's user cache.
+TOKEN_CACHE_TTL_SECONDS = 60
+TOKEN_CACHE_MAX_SIZE = 100_000
+_token_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def _get_cached_token_email(token: str) -> str | None:
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return entry[1]
+
+def _cache_token_email(token: str, email: str, expires_at: int):
+    remaining = expires_at - datetime.now(timezone.utc).timestamp()
+    if remaining <= 0:
+        return
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + min(TOKEN_CACHE_TTL_SECONDS, remaining), email)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
 # --- FastAPI Dependencies for Security ---
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def _get_user_from_token(token: str, db: Session, with_subscription: bool = False):
     """
-    FastAPI dependency to get the current user from a JWT token.
-    The token payload now includes the user's role.
+    Resolves a JWT access token to its user, raising 401 if it is invalid.
+    With with_subscription, the user's subscription is loaded in the same query.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, config.settings.SECRET_KEY, algorithms=[config.settings.ALGORITHM])
-        email: str = payload.get("sub")
-        user_id: int = payload.get("user_id")
-        role: str = payload.get("role") # Get role from token
-        name: str | None = payload.get("name")
-        if email is None or user_id is None or role is None:
+    email = _get_cached_token_email(token)
+    if email is None:
+        try:
+            payload = jwt.decode(token, config.settings.SECRET_KEY, algorithms=[config.settings.ALGORITHM])
+            email: str = payload.get("sub")
+            user_id: int = payload.get("user_id")
+            role: str = payload.get("role") # Get role from token
+            name: str | None = payload.get("name")
+            if email is None or user_id is None or role is None:
+                raise credentials_exception
+            token_data = schema.TokenData(email=email, user_id=user_id, role=role, name=name)
+        except JWTError:
             raise credentials_exception
-        token_data = schema.TokenData(email=email, user_id=user_id, role=role, name=name)
-    except JWTError:
-        raise credentials_exception
+        email = token_data.email
+        _cache_token_email(token, email, payload["exp"])
     
-    user = crud.get_user_by_email(db, email=token_data.email)
+    if with_subscription:
+        user = crud.get_user_by_email(db, email=email, with_subscription=True)
+    else:
+        user = crud.get_user_by_email_cached(db, email=email)
     if user is None:
         raise credentials_exception
     return user
 
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    """
+    FastAPI dependency to get the current user from a JWT token.
+    The token payload now includes the user's role.
+    """
+    return _get_user_from_token(token, db)
+
 def get_current_admin_user(current_user: models.User = Depends(get_current_user)):
     """
     A new dependency that checks if the current user has the 'admin' role.
@@ -74,12 +190,16 @@ def get_current_admin_user(current_user: models.User = Depends(get_current_user)
         )
     return current_user
 
-def get_current_active_subscriber(current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
-    """A stricter dependency for regular users to check for an active subscription."""
+def get_current_active_subscriber(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    """
+    A stricter dependency for regular users to check for an active subscription.
+    The user and their subscription are fetched in a single query.
+    """
+    current_user = _get_user_from_token(token, db, with_subscription=True)
     if not current_user.is_active:
          raise HTTPException(status_code=400, detail="Inactive user")
 
-    subscription = crud.get_subscription_by_user_id(db, user_id=current_user.id)
+    subscription = current_user.subscription
     
     if not subscription or not subscription.is_active:
         raise HTTPException(
@@ -87,7 +207,8 @@ def get_current_active_subscriber(current_user: models.User = Depends(get_curren
             detail="User does not have an active subscription.",
         )
         
-    if subscription.expires_at and subscription.expires_at < datetime.now():
+    # expires_at is stored as naive UTC
+    if subscription.expires_at and subscription.expires_at < datetime.now(timezone.utc).replace(tzinfo=None):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Subscription has expired.",
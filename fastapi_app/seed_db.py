@@ -1,14 +1,14 @@
 # Import the necessary components from your application
 # Using absolute imports to be runnable from the project root
-from fastapi_app.database import engine, SessionLocal, Base
-from fastapi_app import crud, models, schema
+from fastapi_app.database import SessionLocal
+from fastapi_app import crud, models, schema, init_db
 
 print("Connecting to the database to create tables...")
 
 try:
-    # This command inspects all the classes that inherit from Base (your User and Subscription models)
-    # and creates the corresponding tables in the database if they don't already exist.
-    Base.metadata.create_all(bind=engine)
+    # Same schema path as init_db: creates missing tables, then the columns and
+    # indexes that create_all does not add to existing tables
+    init_db.create_tables()
     print("Tables created successfully or already exist.")
 except Exception as e:
     print(f"An error occurred while creating tables: {e}")